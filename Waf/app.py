@@ -1,5 +1,5 @@
-from flask import Flask, request, render_template_string, abort, redirect, url_for, make_response, session, flash, send_file
-from waf_middleware import waf, BLOCKED_IPS
+from flask import Flask, request, render_template_string, abort, redirect, url_for, make_response, session, flash, Response, jsonify
+from waf_middleware import waf, BLOCKED_IPS, start_blocklist_persistence, publish_blocked
 from flask_wtf import FlaskForm, CSRFProtect
 from wtforms import StringField, SubmitField, PasswordField, HiddenField, IntegerField
 from wtforms.validators import DataRequired, NumberRange
@@ -7,12 +7,18 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import bleach
 import os
-from waf_rules import is_malicious, is_lfi, is_rfi, is_cmd_injection, is_path_traversal
-from attack_logger import log_attack
+from waf_rules import classify, classify_batch
+from config import MAX_BODY_SIZE, BATCH_API_TOKEN, BATCH_MAX_ITEMS, BATCH_MAX_ITEM_LENGTH, BATCH_WORKERS
+import hmac
+from attack_logger import log_attack, parse_log_line, parse_sampled_line, export_attacks, clear_logs, read_log
+from event_stream import subscribe, stream
 import time
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('WAF_SECRET_KEY', 'supersecretkey')
+app.config['MAX_CONTENT_LENGTH'] = MAX_BODY_SIZE
+# Set explicitly so the per-field form limit doesn't depend on the Werkzeug version
+app.config['MAX_FORM_MEMORY_SIZE'] = MAX_BODY_SIZE
 
 # Rate Limiting
 limiter = Limiter(get_remote_address, app=app, default_limits=["10 per minute"])
@@ -88,6 +94,12 @@ def admin_login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+@app.before_request
+def start_persistence():
+    # Started on the first request so only the serving process restores and writes
+    # snapshots (never the debug reloader's watcher), under app.run, flask run or WSGI alike
+    start_blocklist_persistence()
+
 @app.before_request
 def before_request_func():
     # Allow access to login/logout/static/favicon even if IP is blocked
@@ -96,6 +108,9 @@ def before_request_func():
     ]
     if any(request.path.startswith(path) for path in allowed_paths):
         return None  # Skip WAF for these paths
+    # A logged-in admin must reach the unblock controls even if their own IP is blocked
+    if session.get('admin_auth') and request.path.startswith('/admin'):
+        return None
     return waf()
 
 @app.route("/", methods=["GET", "POST"])
@@ -111,16 +126,7 @@ def index():
     if scanner_form.validate_on_submit() and scanner_form.scan.data:
         user_input = scanner_form.scan_input.data
         # Use WAF rules to scan input
-        attack_type = is_malicious(user_input)
-        if not attack_type:
-            if is_lfi(user_input):
-                attack_type = "LFI"
-            elif is_rfi(user_input):
-                attack_type = "RFI"
-            elif is_cmd_injection(user_input):
-                attack_type = "CMD Injection"
-            elif is_path_traversal(user_input):
-                attack_type = "Path Traversal"
+        attack_type = classify(user_input)
         if attack_type:
             scan_result = f"Blocked: {attack_type} Detected"
             scan_type = attack_type
@@ -142,6 +148,24 @@ def index():
         return render_template_string(TEMPLATE, message=f"Submitted: {user_input}", error=error, form=form, scanner_form=scanner_form, scan_result=scan_result, scan_type=scan_type, scan_color=scan_color)
     return render_template_string(TEMPLATE, message=message, error=error, form=form, scanner_form=scanner_form, scan_result=scan_result, scan_type=scan_type, scan_color=scan_color)
 
+# Batch scanner for internal services: {"payloads": [...]} -> {"results": [...]} in the same order
+@app.route("/scan/batch", methods=["POST"])
+@limiter.exempt  # authenticated bulk callers; per-request size is capped below
+@csrf.exempt
+def scan_batch():
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not session.get('admin_auth') and not (BATCH_API_TOKEN and hmac.compare_digest(token.encode(), BATCH_API_TOKEN.encode())):
+        return jsonify(error="Unauthorized"), 401
+    data = request.get_json(silent=True) or {}
+    payloads = data.get('payloads')
+    if not isinstance(payloads, list) or not all(isinstance(p, str) for p in payloads):
+        return jsonify(error="Expected JSON body {\"payloads\": [string, ...]}"), 400
+    if len(payloads) > BATCH_MAX_ITEMS:
+        return jsonify(error=f"At most {BATCH_MAX_ITEMS} payloads per request"), 413
+    if any(len(p) > BATCH_MAX_ITEM_LENGTH for p in payloads):
+        return jsonify(error=f"Payloads are limited to {BATCH_MAX_ITEM_LENGTH} characters"), 413
+    return jsonify(results=classify_batch(payloads, workers=BATCH_WORKERS))
+
 @app.errorhandler(403)
 def forbidden(e):
     return render_template_string(TEMPLATE, message=None, error="You have been blocked due to a detected attack or unsafe activity.", form=InputForm(), scanner_form=ScannerForm(), scan_result=None, scan_type=None, scan_color=None), 403
@@ -158,7 +182,6 @@ def admin_login():
         if form.password.data == SETTINGS['admin_password']:
             session['admin_auth'] = True
             flash("Logged in successfully!", "success")
-            BLOCKED_IPS.clear()
             return redirect(url_for('admin_dashboard'))
         else:
             flash("Wrong password.", "danger")
@@ -179,47 +202,44 @@ def admin_root():
 @admin_login_required
 def admin_dashboard():
     # Stats: total events, blocked IPs, last event
-    try:
-        with open("attacks.log", "r") as f:
-            logs = f.readlines()
-    except Exception:
-        logs = []
-    total_events = len(logs)
+    # Live updates add hits written after `logged`, so the page and the stream agree
+    logs, archived, logged = read_log()
+    # Aggregated lines carry a hit count; rotated segments keep theirs in the archive index
+    events = [line for line in logs if parse_log_line(line)]
+    total_events = archived['events'] + sum(parse_log_line(line)['count'] for line in events)
+    sampled_out = dict(archived['sampled_out'])
+    for line in logs:
+        for attack_type, count in (parse_sampled_line(line) or {}).items():
+            sampled_out[attack_type] = sampled_out.get(attack_type, 0) + count
     blocked_ips = list(BLOCKED_IPS.keys())
-    last_event = logs[-1] if logs else None
-    return render_template_string(ADMIN_DASHBOARD_TEMPLATE, total_events=total_events, blocked_ips=blocked_ips, last_event=last_event)
+    last_event = events[-1] if events else None
+    return render_template_string(ADMIN_DASHBOARD_TEMPLATE, total_events=total_events, blocked_ips=blocked_ips, last_event=last_event, sampled_out=sampled_out, logged=logged)
 
 # Security Events page
 @app.route("/admin/events")
 @admin_login_required
 def admin_events():
     block_form = BlockIPForm()
-    try:
-        with open("attacks.log", "r") as f:
-            logs = f.readlines()
-    except Exception:
-        logs = []
+    logs, _, _ = read_log()
     # Parse logs for table
     events = []
     for log in logs:
-        parts = log.strip().split(" | ")
-        if len(parts) >= 3:
-            time_part = parts[0][1:20] if parts[0].startswith("[") else ""
-            ip_part = parts[1].replace("IP: ", "")
-            type_part = parts[2].replace("Type: ", "")
-            desc = parts[3] if len(parts) > 3 else ""
-            sev = "High" if type_part in ["SQLi", "XSS", "LFI", "RFI", "CMD Injection"] else "Medium"
-            events.append({
-                'time': time_part,
-                'ip': ip_part,
-                'type': type_part,
-                'severity': sev,
-                'desc': desc,
-            })
+        event = parse_log_line(log)
+        if event:
+            event['severity'] = "High" if event['type'] in ["SQLi", "XSS", "LFI", "RFI", "CMD Injection"] else "Medium"
+            events.append(event)
     filter_type = request.args.get('type', '')
     filtered_events = [e for e in events if (not filter_type or e['type'] == filter_type)]
     return render_template_string(ADMIN_EVENTS_TEMPLATE, events=filtered_events, all_types=sorted(set(e['type'] for e in events)), filter_type=filter_type, block_form=block_form)
 
+# Live event stream (server-sent events) for the dashboard and events pages
+@app.route("/admin/stream")
+@limiter.exempt
+@admin_login_required
+def admin_stream():
+    return Response(stream(subscribe()), mimetype="text/event-stream",
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Blocked IPs page
 @app.route("/admin/blocked", methods=["GET", "POST"])
 @admin_login_required
@@ -230,20 +250,24 @@ def admin_blocked():
         action = block_form.action.data
         if action == 'unblock':
             BLOCKED_IPS.pop(ip, None)
+            publish_blocked()
             flash(f"Unblocked IP: {ip}", "success")
         return redirect(url_for('admin_blocked'))
     blocked_ips = list(BLOCKED_IPS.keys())
     return render_template_string(ADMIN_BLOCKED_TEMPLATE, blocked_ips=blocked_ips, block_form=block_form)
 
-# Download logs
+# Download logs, optionally filtered by ?start=&end=&type=&ip=, as a streamed gzip export
 @app.route("/admin/logs")
 @admin_login_required
 def admin_logs():
-    try:
-        return send_file("attacks.log", as_attachment=True)
-    except Exception:
-        flash("No log file found.", "danger")
-        return redirect(url_for('admin_dashboard'))
+    export = export_attacks(
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        attack_type=request.args.get('type'),
+        ip=request.args.get('ip'),
+    )
+    return Response(export, mimetype="application/gzip",
+                    headers={'Content-Disposition': 'attachment; filename=attacks-export.log.gz'})
 
 # Settings page
 @app.route("/admin/settings", methods=["GET", "POST"])
@@ -277,7 +301,7 @@ def admin_settings():
     # Handle clear logs
     if clear_logs_form.submit.data and clear_logs_form.validate_on_submit():
         try:
-            open("attacks.log", "w").close()
+            clear_logs()
             flash("Attack logs cleared!", "info")
         except Exception:
             flash("Failed to clear logs.", "danger")
@@ -285,6 +309,7 @@ def admin_settings():
     # Handle unblock all
     if unblock_all_form.submit.data and unblock_all_form.validate_on_submit():
         BLOCKED_IPS.clear()
+        publish_blocked()
         flash("All IPs unblocked!", "info")
         return redirect(url_for('admin_settings'))
     return render_template_string(ADMIN_SETTINGS_TEMPLATE, form=form, clear_logs_form=clear_logs_form, unblock_all_form=unblock_all_form, settings=SETTINGS)
@@ -344,20 +369,38 @@ ADMIN_DASHBOARD_TEMPLATE = '''
         <h3>Dashboard Home</h3>
         <div class="row mb-4">
             <div class="col-md-4">
-                <div class="card text-bg-primary mb-3"><div class="card-body"><h5 class="card-title">Total Events</h5><p class="card-text fs-3">{{ total_events }}</p></div></div>
+                <div class="card text-bg-primary mb-3"><div class="card-body"><h5 class="card-title">Total Events</h5><p class="card-text fs-3" id="total-events">{{ total_events }}</p></div></div>
             </div>
             <div class="col-md-4">
-                <div class="card text-bg-danger mb-3"><div class="card-body"><h5 class="card-title">Blocked IPs</h5><p class="card-text fs-3">{{ blocked_ips|length }}</p></div></div>
+                <div class="card text-bg-danger mb-3"><div class="card-body"><h5 class="card-title">Blocked IPs</h5><p class="card-text fs-3" id="blocked-count">{{ blocked_ips|length }}</p></div></div>
             </div>
             <div class="col-md-4">
-                <div class="card text-bg-success mb-3"><div class="card-body"><h5 class="card-title">Last Event</h5><p class="card-text small">{{ last_event or 'No events yet.' }}</p></div></div>
+                <div class="card text-bg-success mb-3"><div class="card-body"><h5 class="card-title">Last Event</h5><p class="card-text small" id="last-event">{{ last_event or 'No events yet.' }}</p></div></div>
             </div>
         </div>
+        <p class="text-muted small">Sampled out (counted, not logged):
+            {% for t, n in sampled_out.items() %}{{ t }}: {{ n }}{% if not loop.last %}, {% endif %}{% else %}none{% endfor %}
+        </p>
         <a href="/admin/events" class="btn btn-primary">View Security Events</a>
         <a href="/admin/blocked" class="btn btn-danger">Manage Blocked IPs</a>
         <a href="/admin/logs" class="btn btn-secondary">Download Logs</a>
     </div>
 </div>
+<script>
+    const baseTotal = {{ total_events }}, baseLogged = {{ logged }};
+    const source = new EventSource("/admin/stream");
+    source.addEventListener("counters", e => {
+        const c = JSON.parse(e.data);
+        document.getElementById("total-events").textContent = baseTotal + c.logged - baseLogged;
+    });
+    source.addEventListener("blocked", e => {
+        document.getElementById("blocked-count").textContent = JSON.parse(e.data).blocked;
+    });
+    source.addEventListener("attack", e => {
+        const a = JSON.parse(e.data);
+        document.getElementById("last-event").textContent = `[${a.time}] IP: ${a.ip} | Type: ${a.type} | Payload: ${a.payload}`;
+    });
+</script>
 </body>
 </html>
 '''
@@ -386,6 +429,7 @@ ADMIN_EVENTS_TEMPLATE = '''
     </div>
     <div class="flex-grow-1 p-4">
         <h3>Security Events</h3>
+        <p class="text-muted small">Showing the current log segment only. Older, rotated segments are included in Export.</p>
         <form method="get" class="mb-2">
             <label>Filter by Type:</label>
             <select name="type" onchange="this.form.submit()" class="form-select d-inline-block w-auto">
@@ -394,10 +438,11 @@ ADMIN_EVENTS_TEMPLATE = '''
                 <option value="{{ t }}" {% if filter_type==t %}selected{% endif %}>{{ t }}</option>
                 {% endfor %}
             </select>
+            <a href="{{ url_for('admin_logs', type=filter_type or None) }}" class="btn btn-sm btn-outline-secondary ms-2">Export</a>
         </form>
         <table class="table table-bordered table-striped bg-white">
-            <thead><tr><th>#</th><th>Time</th><th>IP Address</th><th>Type</th><th>Severity</th><th>Description</th></tr></thead>
-            <tbody>
+            <thead><tr><th>#</th><th>Time</th><th>IP Address</th><th>Type</th><th>Severity</th><th>Hits</th><th>Description</th></tr></thead>
+            <tbody id="events-body">
             {% for e in events %}
             <tr>
                 <td>{{ loop.index }}</td>
@@ -405,6 +450,7 @@ ADMIN_EVENTS_TEMPLATE = '''
                 <td>{{ e.ip }}</td>
                 <td>{{ e.type }}</td>
                 <td><span class="badge bg-danger">{{ e.severity }}</span></td>
+                <td>{{ e.count }}</td>
                 <td>{{ e.desc }}</td>
             </tr>
             {% endfor %}
@@ -413,6 +459,28 @@ ADMIN_EVENTS_TEMPLATE = '''
         <a href="/admin/dashboard" class="btn btn-secondary mt-3">Back to Dashboard</a>
     </div>
 </div>
+<script>
+    const filterType = {{ filter_type|tojson }};
+    const source = new EventSource("/admin/stream");
+    source.addEventListener("attack", e => {
+        const a = JSON.parse(e.data);
+        if (filterType && a.type !== filterType) return;
+        const body = document.getElementById("events-body");
+        const high = ["SQLi", "XSS", "LFI", "RFI", "CMD Injection"].includes(a.type);
+        const row = body.insertRow(0);
+        // textContent keeps attack payloads from being rendered as HTML
+        ["new", a.time, a.ip, a.type, high ? "High" : "Medium", 1, "Payload: " + a.payload].forEach((value, i) => {
+            const cell = row.insertCell();
+            if (i === 4) {
+                const badge = cell.appendChild(document.createElement("span"));
+                badge.className = "badge bg-danger";
+                badge.textContent = value;
+            } else {
+                cell.textContent = value;
+            }
+        });
+    });
+</script>
 </body>
 </html>
 '''
@@ -621,5 +689,4 @@ TEMPLATE = '''
     '''
 
 if __name__ == "__main__":
-    BLOCKED_IPS.clear()
     app.run(debug=True) 
\ No newline at end of file
@@ -1,5 +1,377 @@
 from datetime import datetime
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from config import (
+    LOG_AGGREGATION_WINDOW, LOG_MAX_PENDING, LOG_SAMPLE_RATES, LOG_DEFAULT_SAMPLE_RATE,
+    LOG_PAYLOAD_LIMITS, LOG_DEFAULT_PAYLOAD_LIMIT, LOG_USER_AGENT_LIMIT, EVENT_STREAM_COUNTER_INTERVAL,
+    LOG_ROTATE_BYTES, LOG_ROTATE_INTERVAL, LOG_ARCHIVE_DIR
+)
+from event_stream import publish
+
+LOG_FILE = "attacks.log"
+
+logger = logging.getLogger(__name__)
+
+# Events waiting to be written, keyed by (ip, type, payload hash)
+PENDING = {}
+# Exact hit counters, including events that were sampled away.
+# 'logged' counts the hits behind the lines written to the log file.
+COUNTERS = {'total': 0, 'written': 0, 'logged': 0, 'by_type': {}, 'sampled_out': {}}
+
+_lock = threading.Lock()
+_flusher = None
+# Rotated segments: {'opened': time the current log was started, 'segments': [...]}
+_index = None
+_index_lock = threading.Lock()
+_counters_published = {'at': 0.0, 'total': 0, 'logged': 0}
+
+
+def _escape(value):
+    # Attacker-controlled text must not be able to start a new line or a new " | " field
+    return value.replace("\\", "\\\\").replace("\r", "\\r").replace("\n", "\\n").replace("|", "\\|")
+
+
+def _truncate(value, limit):
+    if len(value) > limit:
+        return value[:limit] + f"...[+{len(value) - limit} chars]"
+    return value
+
+
+def _format_line(event):
+    first = datetime.fromtimestamp(event['first'])
+    last = datetime.fromtimestamp(event['last'])
+    return (f"[{first}] IP: {event['ip']} | Type: {event['type']} | Payload: {event['payload']} | "
+            f"UA: {event['ua']} | URL: {event['url']} | Count: {event['count']} | Last: {last}\n")
+
 
 def log_attack(ip, attack_type, payload, user_agent="", url=""):
-    with open("attacks.log", "a") as file:
-        file.write(f"[{datetime.now()}] IP: {ip} | Type: {attack_type} | Payload: {payload} | UA: {user_agent} | URL: {url}\n") 
\ No newline at end of file
+    now = time.time()
+    key = (ip, attack_type, hashlib.sha1(payload.encode("utf-8", "replace")).digest())
+    with _lock:
+        COUNTERS['total'] += 1
+        COUNTERS['by_type'][attack_type] = COUNTERS['by_type'].get(attack_type, 0) + 1
+        event = PENDING.get(key)
+        if event is None:
+            # Sampling is decided once per distinct event so repeats follow the same verdict
+            rate = LOG_SAMPLE_RATES.get(attack_type, LOG_DEFAULT_SAMPLE_RATE)
+            event = {
+                'ip': ip,
+                'type': attack_type,
+                'payload': _truncate(_escape(payload), LOG_PAYLOAD_LIMITS.get(attack_type, LOG_DEFAULT_PAYLOAD_LIMIT)),
+                'ua': _truncate(_escape(user_agent), LOG_USER_AGENT_LIMIT),
+                'url': _escape(url),
+                'first': now,
+                'last': now,
+                'count': 0,
+                'sampled': rate >= 1.0 or random.random() < rate,
+            }
+            PENDING[key] = event
+            is_new = True
+        else:
+            is_new = False
+        event['last'] = now
+        event['count'] += 1
+        if not event['sampled']:
+            COUNTERS['sampled_out'][attack_type] = COUNTERS['sampled_out'].get(attack_type, 0) + 1
+        force = len(PENDING) >= LOG_MAX_PENDING
+    # Live viewers see each distinct event once; repeats only move the counters
+    if is_new and event['sampled']:
+        publish('attack', {
+            'time': str(datetime.fromtimestamp(now))[:19],
+            'ip': ip,
+            'type': attack_type,
+            'payload': event['payload'],
+        })
+    publish_counters(now)
+    _ensure_flusher()
+    if force:
+        flush_attacks(force=True)
+
+
+def flush_attacks(force=False):
+    """Write aggregated events whose window has closed (or all of them if force)."""
+    now = time.time()
+    with _lock:
+        done = [k for k, e in PENDING.items() if force or now - e['first'] >= LOG_AGGREGATION_WINDOW]
+        events = [PENDING.pop(k) for k in done]
+        lines = [_format_line(e) for e in events if e['sampled']]
+        # Hits that were sampled away are recorded as one summary line per flush
+        sampled_out = {}
+        for e in events:
+            if not e['sampled']:
+                sampled_out[e['type']] = sampled_out.get(e['type'], 0) + e['count']
+        if sampled_out:
+            lines.append(f"[{datetime.fromtimestamp(now)}] Sampled out: {json.dumps(sampled_out)}\n")
+        if lines:
+            with open(LOG_FILE, "a") as file:
+                file.writelines(lines)
+            COUNTERS['written'] += len(lines)
+            COUNTERS['logged'] += sum(e['count'] for e in events if e['sampled'])
+        _rotate_if_needed(now)
+
+
+def publish_counters(now=None):
+    """Push the hit counters to live viewers, at most once per EVENT_STREAM_COUNTER_INTERVAL."""
+    now = now or time.time()
+    if now - _counters_published['at'] < EVENT_STREAM_COUNTER_INTERVAL:
+        return
+    with _lock:
+        if (_counters_published['total'], _counters_published['logged']) == (COUNTERS['total'], COUNTERS['logged']):
+            return
+        _counters_published['at'] = now
+        _counters_published['total'] = COUNTERS['total']
+        _counters_published['logged'] = COUNTERS['logged']
+        data = {
+            'total': COUNTERS['total'],
+            'logged': COUNTERS['logged'],
+            'by_type': dict(COUNTERS['by_type']),
+            'sampled_out': dict(COUNTERS['sampled_out']),
+        }
+    publish('counters', data)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(max(1, LOG_AGGREGATION_WINDOW / 2))
+        # One failed flush (disk full, rotation error) must not stop the flusher for good
+        try:
+            flush_attacks()
+            # Catch the last counter change of a burst that the throttle skipped
+            publish_counters()
+        except Exception:
+            logger.exception("Flushing attack log failed")
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, daemon=True)
+                _flusher.start()
+
+
+def read_log():
+    """Return the live log's lines, the archived segments' totals and COUNTERS['logged'], all as of the same moment.
+
+    Archived totals are {'events': hits, 'sampled_out': {type: hits}} over compressed segments.
+    """
+    with _lock:
+        try:
+            with open(LOG_FILE, "r", errors="replace") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            lines = []
+        archived = {'events': 0, 'sampled_out': {}}
+        with _index_lock:
+            for segment in _get_index()['segments']:
+                archived['events'] += segment['events']
+                for attack_type, count in segment.get('sampled_out', {}).items():
+                    archived['sampled_out'][attack_type] = archived['sampled_out'].get(attack_type, 0) + count
+        return lines, archived, COUNTERS['logged']
+
+
+def _index_path():
+    return os.path.join(LOG_ARCHIVE_DIR, "index.json")
+
+
+def _get_index():
+    """Return the segment index, loading it on first use. Call with _index_lock held."""
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path()) as file:
+                _index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            _index = {'opened': time.time(), 'segments': []}
+        # Finish compressing segments left over from a previous run
+        for segment in _index['segments']:
+            if not segment['compressed']:
+                threading.Thread(target=_compress_segment, args=(segment['file'],), daemon=True).start()
+    return _index
+
+
+def _save_index():
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    tmp = _index_path() + ".tmp"
+    with open(tmp, "w") as file:
+        json.dump(_index, file)
+    os.replace(tmp, _index_path())
+
+
+def _rotate_if_needed(now):
+    """Move the live log into the archive once it is too big or too old. Call with _lock held."""
+    try:
+        size = os.path.getsize(LOG_FILE)
+    except OSError:
+        size = 0
+    with _index_lock:
+        index = _get_index()
+        if size < LOG_ROTATE_BYTES and now - index['opened'] < LOG_ROTATE_INTERVAL:
+            return
+        index['opened'] = now
+        if size:
+            name = datetime.fromtimestamp(now).strftime("attacks-%Y%m%d-%H%M%S-%f.log")
+            os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+            os.replace(LOG_FILE, os.path.join(LOG_ARCHIVE_DIR, name))
+            index['segments'].append({'file': name, 'start': None, 'end': None, 'events': 0, 'compressed': False})
+        _save_index()
+    if size:
+        # Compression runs off the logging path
+        threading.Thread(target=_compress_segment, args=(name,), daemon=True).start()
+
+
+def _compress_segment(name):
+    raw = os.path.join(LOG_ARCHIVE_DIR, name)
+    start, end, events, sampled_out = None, None, 0, {}
+    try:
+        with open(raw, "rb") as src, gzip.open(raw + ".gz.tmp", "wb") as dst:
+            for line in src:
+                dst.write(line)
+                line = line.decode("utf-8", "replace")
+                event = parse_log_line(line)
+                if event and event['time']:
+                    events += event['count']
+                    start = min(start or event['time'], event['time'])
+                    end = max(end or "", event['last'] or event['time'])
+                for attack_type, count in (parse_sampled_line(line) or {}).items():
+                    sampled_out[attack_type] = sampled_out.get(attack_type, 0) + count
+    except FileNotFoundError:
+        return
+    with _index_lock:
+        segment = next((s for s in _get_index()['segments'] if s['file'] == name), None)
+        if segment is None:
+            # Logs were cleared while this segment was being compressed
+            for path in (raw + ".gz.tmp", raw):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return
+        os.replace(raw + ".gz.tmp", raw + ".gz")
+        segment.update(start=start, end=end, events=events, sampled_out=sampled_out, compressed=True)
+        _save_index()
+    try:
+        os.remove(raw)
+    except FileNotFoundError:
+        pass
+
+
+def _open_segment(path):
+    # The compressor writes the .gz before removing the raw file, so check it on both sides
+    for candidate in (path + ".gz", path, path + ".gz"):
+        try:
+            if candidate.endswith(".gz"):
+                return gzip.open(candidate, "rt", errors="replace")
+            return open(candidate, errors="replace")
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _time_bound(value, fill):
+    """Pad a partial time like '2025-05-20' or '2025-05-20T19:47' to a full log timestamp."""
+    if not value:
+        return None
+    value = value.replace("T", " ")[:19]
+    return value + fill[len(value):]
+
+
+def export_attacks(start=None, end=None, attack_type=None, ip=None, chunk_size=64 * 1024):
+    """Yield a gzip stream of log lines across all segments matching the filters."""
+    start = _time_bound(start, "0000-01-01 00:00:00")
+    end = _time_bound(end, "9999-12-31 23:59:59")
+    with _index_lock:
+        segments = [dict(s) for s in _get_index()['segments']]
+    paths = []
+    for segment in segments:
+        # Segments still being compressed have no range yet and are always read
+        if segment['start'] and ((end and segment['start'] > end) or (start and segment['end'] < start)):
+            continue
+        paths.append(os.path.join(LOG_ARCHIVE_DIR, segment['file']))
+    paths.append(LOG_FILE)
+
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    buffer, size = [], 0
+    for path in paths:
+        file = _open_segment(path)
+        if file is None:
+            continue
+        with file:
+            for line in file:
+                event = parse_log_line(line)
+                if not event or (attack_type and event['type'] != attack_type) or (ip and event['ip'] != ip):
+                    continue
+                if (start and (event['last'] or event['time']) < start) or (end and event['time'] > end):
+                    continue
+                buffer.append(line)
+                size += len(line)
+                if size >= chunk_size:
+                    yield compressor.compress("".join(buffer).encode())
+                    buffer, size = [], 0
+    yield compressor.compress("".join(buffer).encode()) + compressor.flush()
+
+
+def clear_logs():
+    """Delete the live log and every archived segment."""
+    global _index
+    with _lock:
+        open(LOG_FILE, "w").close()
+        with _index_lock:
+            for segment in _get_index()['segments']:
+                for suffix in ("", ".gz"):
+                    try:
+                        os.remove(os.path.join(LOG_ARCHIVE_DIR, segment['file'] + suffix))
+                    except FileNotFoundError:
+                        pass
+            _index = {'opened': time.time(), 'segments': []}
+            _save_index()
+
+
+def parse_log_line(line):
+    """Split a log line into its fields. Returns None for lines that don't look like events."""
+    parts = line.rstrip("\n").split(" | ")
+    if len(parts) < 3 or " IP: " not in parts[0]:
+        return None
+    # The IP shares the first segment with the timestamp: "[time] IP: x"
+    head, _, ip_part = parts[0].strip().partition("] ")
+    fields = {}
+    for part in [ip_part] + parts[1:]:
+        name, sep, value = part.partition(": ")
+        if sep and name in ('IP', 'Type', 'Payload', 'UA', 'URL', 'Count', 'Last'):
+            fields[name] = value
+    count = fields.get('Count', '1')
+    return {
+        'time': head[1:20] if head.startswith("[") else "",
+        'ip': fields.get('IP', ''),
+        'type': fields.get('Type', ''),
+        'payload': fields.get('Payload', ''),
+        'ua': fields.get('UA', ''),
+        'url': fields.get('URL', ''),
+        'count': int(count) if count.isdigit() else 1,
+        'last': fields.get('Last', '')[:19],
+        'desc': f"Payload: {fields['Payload']}" if 'Payload' in fields else "",
+    }
+
+
+def parse_sampled_line(line):
+    """Return the per-type counts of a "Sampled out" summary line, or None for other lines."""
+    _, sep, rest = line.partition("] ")
+    if not sep or not rest.startswith("Sampled out: "):
+        return None
+    counts = rest[len("Sampled out: "):]
+    try:
+        return json.loads(counts)
+    except ValueError:
+        return None
+
+
+atexit.register(flush_attacks, True)
@@ -0,0 +1,77 @@
+from array import array
+import mmap
+import os
+import struct
+import time
+
+# File layout (native byte order), columns so a load can map them without per-record parsing:
+#   header:  magic, version, record count, IP blob length
+#   columns: block expiry (double), last attack time (double), attack count (uint32)
+#   blob:    newline-separated IP strings
+MAGIC = b"WAFB"
+VERSION = 1
+HEADER = struct.Struct("=4sHxxII")
+
+
+def save_blocklist(path, blocked_ips, ip_attacks, block_duration):
+    """Write blocked IPs and attack counters to path atomically (write then rename)."""
+    # Copy first so request threads can keep mutating the dicts
+    blocked = dict(blocked_ips)
+    attacks = dict(ip_attacks)
+    ips = [ip for ip in blocked.keys() | attacks.keys() if ip and "\n" not in ip]
+    expires = array("d", (blocked[ip] + block_duration if ip in blocked else 0.0 for ip in ips))
+    last_attack = array("d", (max(attacks.get(ip) or [0.0]) for ip in ips))
+    counts = array("I", (len(attacks.get(ip) or []) for ip in ips))
+    blob = "\n".join(ips).encode()
+    # Per-process temp name so concurrent writers never share a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(ips), len(blob)))
+        expires.tofile(file)
+        last_attack.tofile(file)
+        counts.tofile(file)
+        file.write(blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+    return len(ips)
+
+
+def load_blocklist(path, blocked_ips, ip_attacks, block_duration):
+    """Restore entries from a snapshot into the given dicts, skipping expired ones."""
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with file:
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            return 0
+        # A corrupt snapshot is treated like a missing one
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, count, blob_len = HEADER.unpack_from(data)
+            start = HEADER.size
+            blob_start = start + count * 20
+            if magic != MAGIC or version != VERSION or len(data) < blob_start + blob_len:
+                return 0
+            try:
+                ips = data[blob_start:blob_start + blob_len].decode().split("\n") if count else []
+            except UnicodeDecodeError:
+                return 0
+            view = memoryview(data)
+            try:
+                expires = view[start:start + count * 8].cast("d")
+                last_attack = view[start + count * 8:start + count * 16].cast("d")
+                counts = view[start + count * 16:blob_start].cast("I")
+                now = time.time()
+                blocked = {ip: e - block_duration for ip, e in zip(ips, expires) if e > now}
+                # Strikes only matter for IPs that aren't blocked. Only the latest
+                # timestamp is kept, so restored strikes expire together.
+                attacks = {ip: [t] * n for ip, t, n in zip(ips, last_attack, counts)
+                           if n and now - t < block_duration and ip not in blocked}
+                for column in (expires, last_attack, counts):
+                    column.release()
+            finally:
+                view.release()
+    blocked_ips.update(blocked)
+    ip_attacks.update(attacks)
+    return len(blocked) + len(attacks)
@@ -1 +1,63 @@
-# إعدادات المشروع (يمكنك إضافة إعدادات هنا لاحقًا) 
\ No newline at end of file
+import os
+
+# Largest request body accepted at all (bytes); bigger requests get 413 before they are read
+MAX_BODY_SIZE = 8 * 1024 * 1024
+
+# Attack log aggregation
+# Identical (IP, type, payload) events inside this window are merged into one line
+LOG_AGGREGATION_WINDOW = 10  # seconds
+LOG_MAX_PENDING = 10000  # distinct events held in memory before a forced flush
+
+# Fraction of distinct events written per attack type (1.0 = keep all)
+LOG_SAMPLE_RATES = {
+    'SQLi': 1.0,
+    'XSS': 1.0,
+    'LFI': 1.0,
+    'RFI': 1.0,
+    'CMD Injection': 1.0,
+    'Path Traversal': 1.0,
+}
+LOG_DEFAULT_SAMPLE_RATE = 1.0
+
+# Max characters of payload / User-Agent written per line
+LOG_PAYLOAD_LIMITS = {}
+LOG_DEFAULT_PAYLOAD_LIMIT = 512
+LOG_USER_AGENT_LIMIT = 256
+
+# Blocklist persistence
+BLOCKLIST_SNAPSHOT_FILE = "blocklist.bin"
+BLOCKLIST_SNAPSHOT_INTERVAL = 30  # seconds
+
+# Live admin event stream
+EVENT_STREAM_BUFFER = 100  # messages queued per subscriber before it is dropped
+EVENT_STREAM_KEEPALIVE = 15  # seconds between keep-alive comments
+EVENT_STREAM_COUNTER_INTERVAL = 1  # min seconds between counter updates
+
+# Attack log rotation
+LOG_ROTATE_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60  # seconds
+LOG_ARCHIVE_DIR = "log_archive"
+
+# Batch classification API
+# Callers send "Authorization: Bearer <token>"; without a token set only a logged-in admin can use it
+BATCH_API_TOKEN = os.environ.get('WAF_BATCH_TOKEN', '')
+BATCH_MAX_ITEMS = 10000  # payloads per request
+BATCH_MAX_ITEM_LENGTH = 64 * 1024  # characters per payload
+BATCH_WORKERS = 1  # processes for large batches (1 = scan in-process)
+
+# Inspection limits for large requests
+# Requests up to one window are joined and scanned whole. Larger ones are scanned field by
+# field in windows that overlap, plus a rolling window across field boundaries, so a match
+# crossing a window edge or spread over several fields is still seen as long as it is no
+# longer than the overlap.
+# Form bodies are parsed only up to MAX_BODY_SIZE; under 'block' anything over
+# WAF_MAX_REQUEST_INSPECT bytes is refused before it is parsed.
+WAF_SCAN_WINDOW = 8 * 1024  # characters
+WAF_SCAN_OVERLAP = 512
+WAF_MAX_FIELD_INSPECT = 256 * 1024  # characters inspected per field
+WAF_MAX_REQUEST_INSPECT = 1024 * 1024  # characters inspected per request
+# What to do with input past the limits:
+#   'block'  - reject the request (413)
+#   'allow'  - inspect only up to the limit, let the rest through
+#   'sample' - spread the inspected windows evenly across the whole value
+WAF_OVERSIZE_POLICY = 'block'
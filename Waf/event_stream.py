@@ -0,0 +1,48 @@
+import json
+import queue
+import threading
+from config import EVENT_STREAM_BUFFER, EVENT_STREAM_KEEPALIVE
+
+# One bounded queue per connected admin page
+SUBSCRIBERS = set()
+_lock = threading.Lock()
+
+
+def subscribe():
+    q = queue.Queue(maxsize=EVENT_STREAM_BUFFER)
+    with _lock:
+        SUBSCRIBERS.add(q)
+    return q
+
+
+def unsubscribe(q):
+    with _lock:
+        SUBSCRIBERS.discard(q)
+
+
+def publish(event, data):
+    """Fan a message out to every subscriber without ever blocking the caller."""
+    if not SUBSCRIBERS:
+        return
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    with _lock:
+        subscribers = list(SUBSCRIBERS)
+    for q in subscribers:
+        try:
+            q.put_nowait(message)
+        except queue.Full:
+            # Slow client: drop it, the browser reconnects with a fresh buffer
+            unsubscribe(q)
+
+
+def stream(q):
+    """Yield server-sent-event messages for a subscriber until it is dropped or disconnects."""
+    try:
+        yield "retry: 3000\n\n"
+        while q in SUBSCRIBERS:
+            try:
+                yield q.get(timeout=EVENT_STREAM_KEEPALIVE)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+    finally:
+        unsubscribe(q)
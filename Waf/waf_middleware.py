@@ -1,6 +1,15 @@
 from flask import request, abort
-from waf_rules import is_malicious, is_lfi, is_rfi, is_cmd_injection, is_path_traversal
+from waf_rules import classify, scan_windows
 from attack_logger import log_attack
+from blocklist_store import save_blocklist, load_blocklist
+from event_stream import publish
+from config import (
+    BLOCKLIST_SNAPSHOT_FILE, BLOCKLIST_SNAPSHOT_INTERVAL, WAF_SCAN_WINDOW, WAF_SCAN_OVERLAP,
+    WAF_MAX_FIELD_INSPECT, WAF_MAX_REQUEST_INSPECT, WAF_OVERSIZE_POLICY
+)
+import atexit
+import logging
+import threading
 import time
 
 # Simple in-memory IP blocklist and attack counter (for demo)
@@ -9,6 +18,84 @@ BLOCKED_IPS = {}
 BLOCK_DURATION = 10 * 60  # 10 minutes in seconds
 MAX_ATTEMPTS = 3
 
+logger = logging.getLogger(__name__)
+
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+_persistence_started = False
+_persistence_lock = threading.Lock()
+
+
+def restore_blocklist():
+    """Load the last snapshot so blocks survive restarts."""
+    return load_blocklist(BLOCKLIST_SNAPSHOT_FILE, BLOCKED_IPS, IP_ATTACKS, BLOCK_DURATION)
+
+
+def snapshot_blocklist():
+    return save_blocklist(BLOCKLIST_SNAPSHOT_FILE, BLOCKED_IPS, IP_ATTACKS, BLOCK_DURATION)
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(BLOCKLIST_SNAPSHOT_INTERVAL)
+        # One failed write (disk full, permissions) must not stop snapshots for good
+        try:
+            snapshot_blocklist()
+        except Exception:
+            logger.exception("Writing blocklist snapshot failed")
+
+
+def start_blocklist_persistence():
+    """Restore the last snapshot and start periodic snapshots. Only the first call does anything."""
+    global _persistence_started
+    if _persistence_started:
+        return
+    with _persistence_lock:
+        if _persistence_started:
+            return
+        # Set first: a failed restore must not be retried (and fail) on every request
+        _persistence_started = True
+        try:
+            restore_blocklist()
+        except Exception:
+            logger.exception("Restoring blocklist snapshot failed")
+        threading.Thread(target=_snapshot_loop, daemon=True).start()
+        atexit.register(snapshot_blocklist)
+
+
+def publish_blocked(ip=None):
+    publish('blocked', {'ip': ip, 'blocked': len(BLOCKED_IPS)})
+
+
+def _scan_large(values):
+    """Scan fields within WAF_MAX_FIELD_INSPECT / WAF_MAX_REQUEST_INSPECT, applying WAF_OVERSIZE_POLICY past them.
+
+    Like the joined scan used for small requests, a match may span any number of
+    fields as long as it is no longer than WAF_SCAN_OVERLAP characters.
+    """
+    budget = WAF_MAX_REQUEST_INSPECT
+    # Last WAF_SCAN_OVERLAP characters of the fields joined so far, so short and
+    # empty fields extend the context instead of replacing it
+    tail = None
+    for value in values:
+        if tail is not None:
+            junction = tail + " " + value[:WAF_SCAN_OVERLAP]
+            attack_type = classify(junction)
+            if attack_type:
+                return attack_type, junction
+            tail = (tail + " " + value[-WAF_SCAN_OVERLAP:])[-WAF_SCAN_OVERLAP:]
+        else:
+            tail = value[-WAF_SCAN_OVERLAP:]
+        limit = min(WAF_MAX_FIELD_INSPECT, budget)
+        if len(value) > limit and WAF_OVERSIZE_POLICY == 'block':
+            abort(413, "Request too large to inspect.")
+        attack_type, snippet = scan_windows(value, WAF_SCAN_WINDOW, WAF_SCAN_OVERLAP, limit,
+                                            sample=WAF_OVERSIZE_POLICY == 'sample')
+        if attack_type:
+            return attack_type, snippet
+        budget -= min(len(value), limit)
+    return None, ""
+
 
 def waf():
     ip = request.remote_addr
@@ -20,28 +107,26 @@ def waf():
         if now - BLOCKED_IPS[ip] > BLOCK_DURATION:
             del BLOCKED_IPS[ip]
             IP_ATTACKS.pop(ip, None)
+            publish_blocked()
         else:
             return abort(403, "Your IP is temporarily blocked due to repeated attacks.")
 
-    payload = ""
+    # Refuse oversized form bodies before request.form reads them into memory
+    if (WAF_OVERSIZE_POLICY == 'block' and request.mimetype in FORM_MIMETYPES
+            and (request.content_length or 0) > WAF_MAX_REQUEST_INSPECT):
+        abort(413, "Request too large to inspect.")
 
     # جمع كل البيانات من POST و GET
-    if request.args:
-        payload += " ".join(request.args.values())
-    if request.form:
-        payload += " ".join(request.form.values())
-
-    # أنواع الهجمات
-    attack_type = is_malicious(payload)
-    if not attack_type:
-        if is_lfi(payload):
-            attack_type = "LFI"
-        elif is_rfi(payload):
-            attack_type = "RFI"
-        elif is_cmd_injection(payload):
-            attack_type = "CMD Injection"
-        elif is_path_traversal(payload):
-            attack_type = "Path Traversal"
+    values = list(request.args.values()) + list(request.form.values())
+
+    if sum(len(v) for v in values) <= WAF_SCAN_WINDOW:
+        payload = " ".join(values)
+
+        # أنواع الهجمات
+        attack_type = classify(payload)
+    else:
+        # Large request: scan each field in windows instead of joining copies of everything
+        attack_type, payload = _scan_large(values)
 
     if attack_type:
         log_attack(
@@ -59,5 +144,6 @@ def waf():
         IP_ATTACKS[ip] = attacks
         if len(attacks) >= MAX_ATTEMPTS:
             BLOCKED_IPS[ip] = now
+            publish_blocked(ip)
             return abort(403, "Your IP is temporarily blocked due to repeated attacks.")
         return abort(403, f"Blocked by WAF: Detected {attack_type}") 
\ No newline at end of file
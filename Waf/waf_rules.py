@@ -1,4 +1,9 @@
+import multiprocessing
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import WAF_SCAN_WINDOW, WAF_SCAN_OVERLAP
 
 # أنماط لكشف هجمات SQLi و XSS
 SQLI_PATTERNS = [
@@ -56,35 +61,135 @@ PATH_TRAVERSAL_PATTERNS = [
     r"\\\.\.\\"
 ]
 
+def _compile(patterns, flags=0):
+    # كل مجموعة أنماط تصبح regex واحد مُجمّع مسبقاً
+    # A leading (?i) only applies to its own pattern once they are joined
+    parts = [f"(?i:{p[4:]})" if p.startswith("(?i)") else f"(?:{p})" for p in patterns]
+    return re.compile("|".join(parts), flags)
+
+SQLI_RE = _compile(SQLI_PATTERNS)
+XSS_RE = _compile(XSS_PATTERNS)
+LFI_RE = _compile(LFI_PATTERNS, re.IGNORECASE)
+RFI_RE = _compile(RFI_PATTERNS, re.IGNORECASE)
+CMD_INJECTION_RE = _compile(CMD_INJECTION_PATTERNS, re.IGNORECASE)
+PATH_TRAVERSAL_RE = _compile(PATH_TRAVERSAL_PATTERNS, re.IGNORECASE)
+
+# Checked in order, first match wins
+CHECKS = [
+    ("SQLi", SQLI_RE),
+    ("XSS", XSS_RE),
+    ("LFI", LFI_RE),
+    ("RFI", RFI_RE),
+    ("CMD Injection", CMD_INJECTION_RE),
+    ("Path Traversal", PATH_TRAVERSAL_RE),
+]
+
+# Every pattern above contains at least one of these literals (compared against the
+# lower-cased payload), so an ASCII payload without any of them cannot match a rule.
+# Keep this in sync when adding patterns.
+SCREEN_LITERALS = [
+    "=", "<", ";", "|", "&&", "..", "://", "'--",
+    "alert", "union", "true", "select", "insert", "drop", "update", "delete", "document",
+    "/etc/passwd", "/proc/self/environ", "c:\\windows\\win",
+]
+
+BATCH_PARALLEL_THRESHOLD = 5000  # unique payloads before a worker pool is worth it
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
 def is_malicious(payload: str) -> str:
-    for pattern in SQLI_PATTERNS:
-        if re.search(pattern, payload):
-            return "SQLi"
-    for pattern in XSS_PATTERNS:
-        if re.search(pattern, payload):
-            return "XSS"
+    if SQLI_RE.search(payload):
+        return "SQLi"
+    if XSS_RE.search(payload):
+        return "XSS"
     return None
 
 def is_lfi(payload: str) -> bool:
-    for pattern in LFI_PATTERNS:
-        if re.search(pattern, payload, re.IGNORECASE):
-            return True
-    return False
+    return bool(LFI_RE.search(payload))
 
 def is_rfi(payload: str) -> bool:
-    for pattern in RFI_PATTERNS:
-        if re.search(pattern, payload, re.IGNORECASE):
-            return True
-    return False
+    return bool(RFI_RE.search(payload))
 
 def is_cmd_injection(payload: str) -> bool:
-    for pattern in CMD_INJECTION_PATTERNS:
-        if re.search(pattern, payload, re.IGNORECASE):
-            return True
-    return False
+    return bool(CMD_INJECTION_RE.search(payload))
 
 def is_path_traversal(payload: str) -> bool:
-    for pattern in PATH_TRAVERSAL_PATTERNS:
-        if re.search(pattern, payload, re.IGNORECASE):
-            return True
-    return False 
\ No newline at end of file
+    return bool(PATH_TRAVERSAL_RE.search(payload))
+
+def classify(payload: str) -> str:
+    """Return the first attack type detected in payload, or None."""
+    # Fast path for clean input. Non-ASCII text always takes the full scan because
+    # IGNORECASE also matches letters such as 'ſ' and 'K' that lower() doesn't fold to ASCII.
+    if payload.isascii():
+        lowered = payload.lower()
+        if not any(literal in lowered for literal in SCREEN_LITERALS):
+            return None
+    for attack_type, regex in CHECKS:
+        if regex.search(payload):
+            return attack_type
+    return None
+
+def scan_windows(value, window, overlap, limit=None, sample=False):
+    """Classify value one window at a time, inspecting at most limit characters.
+
+    Returns (attack_type, matching window) or (None, ""). Past the limit only the
+    head is inspected, or with sample=True windows spread evenly across the value.
+    """
+    length = len(value)
+    limit = length if limit is None else min(limit, length)
+    window = min(window, limit)
+    if window <= 0:
+        return None, ""
+    overlap = min(overlap, window // 2)
+    step = window - overlap
+    count = max(1, -(-(limit - overlap) // step))  # windows needed to cover limit characters
+    if sample and limit < length and count > 1:
+        last = length - window
+        starts = [i * last // (count - 1) for i in range(count)]
+    else:
+        starts = range(0, count * step, step)
+    for start in starts:
+        chunk = value[start:start + window]
+        attack_type = classify(chunk)
+        if attack_type:
+            return attack_type, chunk
+    return None, ""
+
+def _classify_chunk(payloads):
+    # Long items are scanned in windows so each regex pass stays bounded
+    return [classify(p) if len(p) <= WAF_SCAN_WINDOW else scan_windows(p, WAF_SCAN_WINDOW, WAF_SCAN_OVERLAP)[0]
+            for p in payloads]
+
+def classify_batch(payloads, workers=None, chunk_size=1000):
+    """Classify many payloads at once. Returns verdicts in input order.
+
+    Identical payloads are only scanned once. With workers > 1, batches with at
+    least BATCH_PARALLEL_THRESHOLD unique payloads are split across a process pool.
+    """
+    global _pool, _pool_workers
+    payloads = list(payloads)
+    unique = list(dict.fromkeys(payloads))
+    if workers and workers > 1 and len(unique) >= BATCH_PARALLEL_THRESHOLD:
+        # Request threads share one pool; create or resize it under the lock.
+        # Workers are spawned, not forked, because the server process runs other threads.
+        with _pool_lock:
+            if _pool is None or _pool_workers != workers:
+                if _pool is not None:
+                    _pool.shutdown(wait=False)
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                _pool_workers = workers
+            pool = _pool
+        chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+        try:
+            verdicts = [v for chunk in pool.map(_classify_chunk, chunks) for v in chunk]
+        except BrokenProcessPool:
+            # A worker died: drop the pool so the next batch builds a fresh one, and finish in-process
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+            verdicts = _classify_chunk(unique)
+    else:
+        verdicts = _classify_chunk(unique)
+    lookup = dict(zip(unique, verdicts))
+    return [lookup[p] for p in payloads] 
\ No newline at end of file